@@ -1,7 +1,19 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
-from fpdf import FPDF
-import io
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from fpdf import FPDF, FontFace
+import functools
+import hashlib
+import http.client
+import os
+import tempfile
+import time
+import urllib.request
+import uuid
 
 # --- Configuration ---
 st.set_page_config(layout="wide", page_title="Survey Data Analysis")
@@ -10,13 +22,183 @@ st.set_page_config(layout="wide", page_title="Survey Data Analysis")
 # Replace with your actual Google Sheet CSV link
 GOOGLE_SHEET_CSV_URL = "https://docs.google.com/spreadsheets/d/e/2PACX-1vQPm63U2trERuMHq9KqyY2yHXB5TzIKb5kzASsKmNobBAq9f1rEu8_OEyhY8gY6mXjuwvQf90Sr0Q7I/pub?gid=0&single=true&output=csv" # Replace this
 
-@st.cache_data(ttl=600) # Cache data for 10 minutes
+# --- Survey Columns ---
+SURVEY_QUESTION_COLUMNS = [
+    "Do you know who the KPCC President is?",
+    "Can you name the person?",
+    "Who is your favorite candidate for Chief Minister?",
+    "Who do you think will win in your constituency?",
+    "Who do you think will win the overall State Assembly Elections?",
+    "Whom will you vote for?"
+]
+
+DEMOGRAPHIC_COLS_FOR_TABLES = {
+    "What is your gender?": "What is your gender?",
+    "What is your age?": "What is your age?",
+    "What is your religion?": "What is your religion?",
+    "What is your community?": "What is your community?"
+}
+
+# Labelled at load time and stored as categoricals, so survey columns are counted directly by category code
+MISSING_VALUE_LABELS = {col: "Not Answered" for col in SURVEY_QUESTION_COLUMNS}
+MISSING_VALUE_LABELS.update({col: "Not Specified" for col in DEMOGRAPHIC_COLS_FOR_TABLES.values()})
+CATEGORICAL_COLUMNS = ["AC Name", *MISSING_VALUE_LABELS]
+
+# The combined PDF splits questions with many responses into several tables of at most this many
+# percentage columns, each repeating the demographic and Total Number columns, so no column gets too
+# narrow for fpdf2 to render
+PDF_PERCENTAGE_COLS_PER_TABLE = 6
+
+# Parsed survey frames are also kept on disk so other workers and restarts can skip the CSV parse
+PARQUET_CACHE_DIR = tempfile.gettempdir()
+PARQUET_VALIDATOR_KEY = b"survey_source_validator"
+# Bump when parsing changes what a frame contains, so caches written by older code are not reused
+PARQUET_CACHE_VERSION = 2
+# Within this many seconds of being written or revalidated the cache is used without asking the source
+PARQUET_CACHE_MAX_AGE = 600
+# Seconds to wait on the HEAD request that checks the cache; on timeout the CSV is parsed instead
+SOURCE_VALIDATOR_TIMEOUT = 5
+
+# Cells read as missing, matching pd.read_csv's defaults; Arrow's own list lacks "None" and "<NA>"
+CSV_NULL_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+]
+
+
+def _parquet_cache_path(url):
+    """Location of the on-disk Parquet copy of the survey at url."""
+    url_digest = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(PARQUET_CACHE_DIR, f"survey_{url_digest}_v{PARQUET_CACHE_VERSION}.parquet")
+
+
+def _fetch_source_validator(url):
+    """Return the ETag (or Last-Modified) header for url, or None if the server sends neither or can't be reached."""
+    try:
+        request = urllib.request.Request(url, method="HEAD")
+        with urllib.request.urlopen(request, timeout=SOURCE_VALIDATOR_TIMEOUT) as response:
+            return response.headers.get("ETag") or response.headers.get("Last-Modified")
+    # URLError and timeouts are OSErrors; http.client errors such as RemoteDisconnected are not wrapped in URLError
+    except (OSError, http.client.HTTPException, ValueError):
+        return None
+
+
+def _parquet_cache_is_fresh(path):
+    """Whether the cache at path was written or revalidated within PARQUET_CACHE_MAX_AGE."""
+    try:
+        return time.time() - os.path.getmtime(path) < PARQUET_CACHE_MAX_AGE
+    except OSError:
+        return False
+
+
+def _read_parquet_cache(path, validator, check_validator=True):
+    """Load the cached frame if it was written from the same version of the source.
+
+    check_validator=False skips the version check, for a cache that _parquet_cache_is_fresh.
+    """
+    if (check_validator and validator is None) or not os.path.exists(path):
+        return None
+    try:
+        metadata = pq.read_schema(path).metadata or {}
+        if check_validator and metadata.get(PARQUET_VALIDATOR_KEY) != validator.encode("utf-8"):
+            return None
+        df = pd.read_parquet(path, engine="pyarrow", memory_map=True)
+    except (OSError, pa.ArrowException):
+        return None
+    # The table code relies on the load-time dtypes; reparse anything written without them
+    if not all(isinstance(df[col].dtype, pd.CategoricalDtype) for col in CATEGORICAL_COLUMNS if col in df.columns):
+        return None
+    return df
+
+
+def _write_parquet_cache(df, path, validator):
+    """Persist df with its source validator; failures only cost the next cold load."""
+    if validator is None:
+        return
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata(
+            {**(table.schema.metadata or {}), PARQUET_VALIDATOR_KEY: validator.encode("utf-8")}
+        )
+        pq.write_table(table, tmp_path, compression="zstd")
+        os.replace(tmp_path, path)
+    except (OSError, pa.ArrowException):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _touch_parquet_cache(path):
+    """Mark the cache at path as just revalidated."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _arrow_types_mapper(arrow_type):
+    """Keep plain string columns Arrow-backed; other types, including dictionaries, convert as usual."""
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return pd.ArrowDtype(arrow_type)
+    return None
+
+
+def _read_survey_csv(url):
+    """Download and parse the survey CSV into a frame with categorical survey columns."""
+    with urllib.request.urlopen(url) as response:
+        raw_csv = response.read()
+    # Parse with Arrow's multithreaded reader into columnar buffers rather than Python objects.
+    # Free-text answers can hold quoted line breaks, which Arrow only handles across its blocks when told to
+    table = pacsv.read_csv(
+        pa.py_buffer(raw_csv),
+        parse_options=pacsv.ParseOptions(newlines_in_values=True),
+        convert_options=pacsv.ConvertOptions(null_values=CSV_NULL_VALUES, strings_can_be_null=True),
+    )
+    table = table.rename_columns([name.strip() for name in table.column_names])
+
+    # Label missing survey answers and dictionary-encode the low-cardinality columns while still in Arrow;
+    # to_pandas turns dictionary columns into categoricals, so counting and filtering work on integer codes
+    categorical_cols = [col for col in CATEGORICAL_COLUMNS if col in table.column_names]
+    for i, field in enumerate(table.schema):
+        column = table.column(i)
+        if field.name in categorical_cols:
+            column = column.cast(pa.string())
+        if pa.types.is_string(column.type):
+            column = pc.utf8_trim_whitespace(column)
+        if field.name in MISSING_VALUE_LABELS:
+            column = pc.fill_null(column, MISSING_VALUE_LABELS[field.name])
+        if field.name in categorical_cols:
+            column = pc.dictionary_encode(column)
+        table = table.set_column(i, field.name, column)
+    df = table.to_pandas(types_mapper=_arrow_types_mapper)
+
+    # Arrow dictionaries keep first-seen order; sort them so e.g. the AC selector can read categories directly
+    for col in categorical_cols:
+        df[col] = df[col].cat.reorder_categories(sorted(df[col].cat.categories))
+    return df
+
+
+# Cached as a shared resource: every session and rerun gets the same frame instead of an unpickled copy,
+# so the code below must treat df_survey_original as read-only
+@st.cache_resource(ttl=600) # Cache data for 10 minutes
 def load_data(url):
     try:
-        df = pd.read_csv(url)
-        df.columns = df.columns.str.strip()
-        for col in df.select_dtypes(include=['object']):
-            df[col] = df[col].str.strip()
+        cache_path = _parquet_cache_path(url)
+        # A recently written cache is used as is, so cold starts within its max age skip even the HEAD request
+        df = None
+        if _parquet_cache_is_fresh(cache_path):
+            df = _read_parquet_cache(cache_path, None, check_validator=False)
+        if df is None:
+            validator = _fetch_source_validator(url)
+            df = _read_parquet_cache(cache_path, validator)
+            if df is None:
+                df = _read_survey_csv(url)
+                _write_parquet_cache(df, cache_path, validator)
+            else:
+                # The source has not changed, so the cache is good for another max age
+                _touch_parquet_cache(cache_path)
+        # Identifies this load, so derived caches can key on it instead of hashing the whole frame
+        df.attrs["load_id"] = uuid.uuid4().hex
         return df
     except Exception as e:
         st.error(f"Error loading data: {e}")
@@ -25,84 +207,239 @@ def load_data(url):
 df_survey_original = load_data(GOOGLE_SHEET_CSV_URL)
 
 
-def _generate_table_df(df_ac, selected_question, demo_display_name, demo_actual_col, response_columns_ordered):
-    """Create the cross tabulation table dataframe for one AC and demographic."""
-    df_for_crosstab = df_ac.copy()
-    df_for_crosstab[selected_question] = df_for_crosstab[selected_question].fillna("Not Answered").astype(str)
-    df_for_crosstab[demo_actual_col] = df_for_crosstab[demo_actual_col].fillna("Not Specified").astype(str)
-    if df_for_crosstab.empty:
+def _survey_frame_token(df):
+    """Cache key for df_survey_original: the id of the load_data call that produced it."""
+    return df.attrs.get("load_id", id(df))
+
+
+def _response_columns_ordered(question_series, selected_question):
+    """Response columns for the selected question, in display order.
+
+    question_series must come from df_survey_original, whose categories are exactly the responses
+    present in the survey, already sorted at load time.
+    """
+    unique_responses = question_series.cat.categories.tolist()
+    # For the specific KPCC question, we prioritize "No" and "Yes" as per the image
+    if selected_question == "Do you know who the KPCC President is?":
+        response_columns_ordered = ["No", "Yes"]
+        # Add 'Not Answered' if it exists in the data for this question
+        if "Not Answered" in unique_responses:
+            response_columns_ordered.append("Not Answered")
+        return response_columns_ordered
+    # For other questions, take all unique responses, sorted for consistency
+    return unique_responses
+
+
+def _category_counts(*columns):
+    """Row counts for every combination of categories of the given categorical columns.
+
+    One np.bincount over the combined category codes; the result has one axis per column, sized by
+    its number of categories. Rows missing a value in any of the columns are not counted.
+    """
+    shape = tuple(len(col.cat.categories) for col in columns)
+    codes = [col.cat.codes.to_numpy() for col in columns]
+    present = np.logical_and.reduce([col_codes >= 0 for col_codes in codes])
+    combined_codes = np.ravel_multi_index([col_codes[present] for col_codes in codes], shape)
+    return np.bincount(combined_codes, minlength=int(np.prod(shape))).reshape(shape)
+
+
+def _counts_frame(counts, demo_series, question_series):
+    """Demographic x response count matrix as a frame, keeping only the categories present in the rows."""
+    counts_df = pd.DataFrame(
+        counts,
+        index=pd.Index(demo_series.cat.categories, name=demo_series.name),
+        columns=pd.Index(question_series.cat.categories, name=question_series.name),
+    )
+    return counts_df[counts.sum(axis=1) > 0]
+
+
+def _demographic_response_counts(df, question_series, demo_cols):
+    """Response counts per category of each demographic column, one bincount per demographic."""
+    return {
+        col: _counts_frame(_category_counts(df[col], question_series), df[col], question_series)
+        for col in demo_cols
+    }
+
+
+def _grand_total_row(response_totals, response_columns_ordered):
+    """Grand Total values (Total Number and response percentages) shared by every demographic table.
+
+    response_totals holds the count of every response, indexed by response.
+    """
+    grand_total_base_count = int(response_totals.sum())
+    counts = response_totals.reindex(response_columns_ordered, fill_value=0).to_numpy()
+    percentages = counts / grand_total_base_count * 100 if grand_total_base_count > 0 else np.zeros(len(counts))
+    grand_total_row = {"Total Number": grand_total_base_count}
+    grand_total_row.update(zip([f"{resp} %" for resp in response_columns_ordered], percentages))
+    return grand_total_row
+
+
+def _generate_table_df(response_counts, grand_total_row, demo_display_name, response_columns_ordered):
+    """Create the cross tabulation table dataframe for one AC and demographic.
+
+    response_counts is that demographic's entry from _demographic_response_counts and
+    grand_total_row the _grand_total_row of the same responses.
+    """
+    if response_counts.empty:
         return pd.DataFrame()
 
-    crosstab_df = pd.crosstab(df_for_crosstab[demo_actual_col], df_for_crosstab[selected_question])
-    for resp in response_columns_ordered:
-        if resp not in crosstab_df.columns:
-            crosstab_df[resp] = 0
-    crosstab_df = crosstab_df[response_columns_ordered]
-    crosstab_df["Total Number"] = crosstab_df.sum(axis=1)
-
-    for resp in response_columns_ordered:
-        perc_col = f"{resp} %"
-        crosstab_df[perc_col] = (crosstab_df[resp] / crosstab_df["Total Number"].replace(0, pd.NA) * 100)
-
-    crosstab_df = crosstab_df.reset_index()
-    crosstab_df.rename(columns={demo_actual_col: demo_display_name}, inplace=True)
-
-    display_cols_final_order = [demo_display_name, "Total Number"] + [f"{resp} %" for resp in response_columns_ordered]
-    table_df_final = crosstab_df[display_cols_final_order].copy()
-
-    grand_total_base_count = len(df_ac)
-    grand_total_row = {demo_display_name: "Grand Total", "Total Number": grand_total_base_count}
-    counts = df_ac[selected_question].fillna("Not Answered").astype(str).value_counts()
-    for resp in response_columns_ordered:
-        count = counts.get(resp, 0)
-        perc = (count / grand_total_base_count * 100) if grand_total_base_count > 0 else 0
-        grand_total_row[f"{resp} %"] = perc
-
-    for col in table_df_final.columns:
-        if col not in grand_total_row:
-            grand_total_row[col] = pd.NA
-    grand_total_df = pd.DataFrame([grand_total_row])[table_df_final.columns]
-    table_df_final = pd.concat([table_df_final, grand_total_df], ignore_index=True)
-
-    for resp in response_columns_ordered:
-        perc_col = f"{resp} %"
-        table_df_final[perc_col] = table_df_final[perc_col].apply(lambda x: f"{x:.2f}%" if pd.notnull(x) else x)
+    # reindex adds any missing response columns and fixes their order (e.g., 'No' then 'Yes')
+    crosstab_df = response_counts.reindex(columns=response_columns_ordered, fill_value=0)
+    percentage_cols = [f"{resp} %" for resp in response_columns_ordered]
+
+    # Percentages within each demographic category on plain float arrays; empty categories stay NaN
+    counts = crosstab_df.to_numpy()
+    totals = counts.sum(axis=1)
+    percentages = np.divide(
+        counts, totals[:, None], out=np.full(counts.shape, np.nan), where=totals[:, None] > 0
+    ) * 100
+
+    # Stack the Grand Total onto the arrays so the table is built in one go rather than grown by a row
+    totals = np.append(totals, grand_total_row["Total Number"])
+    percentages = np.vstack([percentages, [grand_total_row[col] for col in percentage_cols]])
+
+    # Format all percentage cells in one vectorised pass; undefined percentages stay missing
+    formatted = np.char.add(np.char.mod("%.2f", percentages), "%").astype(object)
+    formatted[np.isnan(percentages)] = pd.NA
+
+    table_df_final = pd.DataFrame({
+        demo_display_name: [*crosstab_df.index.astype(str), "Grand Total"],
+        "Total Number": totals,
+        **dict(zip(percentage_cols, formatted.T)),
+    })
     return table_df_final
 
 
-def create_combined_ac_pdf(df, selected_question, demographics):
+@st.cache_data(ttl=600, show_spinner=False, hash_funcs={pd.DataFrame: _survey_frame_token})
+def response_columns_for_question(df, selected_question):
+    """Response columns for the selected question across the whole survey, in display order.
+
+    Using the full survey keeps the columns stable across AC selections. df must be df_survey_original.
+    """
+    return _response_columns_ordered(df[selected_question], selected_question)
+
+
+def _select_acs(df, ac_key):
+    """Rows of df for the ACs in ac_key; an empty ac_key means all constituencies."""
+    return df.loc[df["AC Name"].isin(ac_key)] if ac_key else df
+
+
+@st.cache_data(ttl=600, show_spinner=False, hash_funcs={pd.DataFrame: _survey_frame_token})
+def compute_tables(df, ac_key, selected_question, demographics):
+    """Build the display table for every demographic, restricted to the ACs in ac_key (all ACs if empty).
+
+    df must be df_survey_original: it is keyed by its load id, not by its contents.
+    """
+    df_selected = _select_acs(df, ac_key)
+    question_series = df_selected[selected_question]
+    response_columns_ordered = response_columns_for_question(df, selected_question)
+    demographics = {display: actual for display, actual in demographics.items() if actual in df_selected.columns}
+    counts_by_demo = _demographic_response_counts(df_selected, question_series, list(demographics.values()))
+    grand_total_row = _grand_total_row(question_series.value_counts(sort=False), response_columns_ordered)
+    return {
+        demo_display: _generate_table_df(counts_by_demo[demo_actual_col], grand_total_row, demo_display, response_columns_ordered)
+        for demo_display, demo_actual_col in demographics.items()
+    }
+
+
+def create_combined_ac_pdf(df, selected_question, demographics, response_columns_ordered):
     """Generate a PDF with tables for each AC in the DataFrame."""
     pdf = FPDF()
     pdf.set_auto_page_break(auto=True, margin=15)
 
-    if selected_question == "Do you know who the KPCC President is?":
-        response_columns_ordered = ["No", "Yes"]
-        unique_responses = df[selected_question].fillna("Not Answered").astype(str).unique()
-        if "Not Answered" in unique_responses and "Not Answered" not in response_columns_ordered:
-            response_columns_ordered.append("Not Answered")
-    else:
-        response_columns_ordered = sorted(df[selected_question].fillna("Not Answered").astype(str).unique())
-
-    for ac in sorted(df["AC Name"].dropna().unique()):
-        ac_df = df[df["AC Name"] == ac]
+    # Every table has the same columns (demographic, Total Number, one % per response). Wide questions are
+    # split into chunks of percentage columns; each chunk's column positions and table layout are set up once
+    # for the whole PDF
+    headings_style = FontFace(emphasis="BOLD", fill_color=(200, 220, 255))
+    grand_total_style = FontFace(emphasis="BOLD")
+    num_responses = len(response_columns_ordered)
+    table_chunks = []
+    for start in range(0, max(num_responses, 1), PDF_PERCENTAGE_COLS_PER_TABLE):
+        stop = min(start + PDF_PERCENTAGE_COLS_PER_TABLE, num_responses)
+        chunk_positions = [0, 1, *range(2 + start, 2 + stop)]
+        num_cols = len(chunk_positions)
+        table_options = dict(
+            col_widths=(3, 2) + (2,) * (num_cols - 2),
+            text_align=("LEFT",) + ("RIGHT",) * (num_cols - 1),
+            headings_style=headings_style,
+            line_height=5,
+        )
+        table_chunks.append((chunk_positions, table_options))
+
+    # The AC x response totals are small, so every AC's Grand Total comes from one count up front.
+    # For the demographic tables, sort the needed columns by AC once so each AC's rows are a contiguous
+    # slice counted on its own (demographic x response per AC) rather than filtering the frame for each AC;
+    # this keeps memory to one AC's counts instead of a dense AC x demographic x response array per demographic
+    ac_series = df["AC Name"]
+    question_series = df[selected_question]
+    demographics = {display: actual for display, actual in demographics.items() if actual in df.columns}
+    response_totals_by_ac = _category_counts(ac_series, question_series)
+    ac_codes = ac_series.cat.codes.to_numpy()
+    row_order = np.argsort(ac_codes, kind="stable")
+    ac_bounds = np.searchsorted(ac_codes[row_order], np.arange(len(ac_series.cat.categories) + 1))
+    rows_by_ac = df[[selected_question, *demographics.values()]].iloc[row_order]
+
+    for ac_index, ac in enumerate(ac_series.cat.categories):
+        if response_totals_by_ac[ac_index].sum() == 0:
+            continue # AC not in the selected rows
+        ac_rows = rows_by_ac.iloc[ac_bounds[ac_index]:ac_bounds[ac_index + 1]]
+        ac_question_series = ac_rows[selected_question]
         pdf.add_page()
         pdf.set_font("Arial", "B", 16)
         pdf.cell(0, 10, f"Constituency: {ac}", ln=True)
 
+        grand_total_row = _grand_total_row(
+            pd.Series(response_totals_by_ac[ac_index], index=question_series.cat.categories), response_columns_ordered
+        )
         for demo_display, demo_actual_col in demographics.items():
-            if demo_actual_col not in ac_df.columns:
-                continue
-            table_df = _generate_table_df(ac_df, selected_question, demo_display, demo_actual_col, response_columns_ordered)
-            if table_df.empty:
-                continue
+            demo_counts = _category_counts(ac_rows[demo_actual_col], ac_question_series)
+            if not demo_counts.any():
+                continue # nothing counted for this demographic in this AC, so no table to build
+            counts_df = _counts_frame(demo_counts, df[demo_actual_col], question_series)
+            table_df = _generate_table_df(counts_df, grand_total_row, demo_display, response_columns_ordered)
             pdf.set_font("Arial", "B", 12)
             pdf.cell(0, 10, demo_display, ln=True)
-            pdf.set_font("Courier", size=8)
-            table_text = table_df.to_string(index=False)
-            pdf.multi_cell(0, 4, table_text)
-            pdf.ln(2)
-
-    return pdf.output(dest="S").encode("latin-1")
+            # fpdf2's table lays out each row in one go; fonts change only for the heading and Grand Total rows
+            pdf.set_font("Arial", size=8)
+            headings = table_df.columns.to_numpy(dtype=object)
+            cells = table_df.fillna("").astype(str).to_numpy(dtype=object)
+            for chunk_positions, table_options in table_chunks:
+                chunk_cells = cells[:, chunk_positions].tolist()
+                with pdf.table(**table_options) as table:
+                    table.row(headings[chunk_positions].tolist())
+                    for row in chunk_cells[:-1]:
+                        table.row(row)
+                    # _generate_table_df always ends the table with the Grand Total row
+                    table.row(chunk_cells[-1], style=grand_total_style)
+                pdf.ln(2)
+
+    return bytes(pdf.output())
+
+
+@st.cache_data(ttl=600, show_spinner=False, hash_funcs={pd.DataFrame: _survey_frame_token})
+def combined_ac_pdf_bytes(df, ac_key, selected_question, demographics):
+    """Cached combined AC PDF for the ACs in ac_key (all ACs if empty).
+
+    df must be df_survey_original: it is keyed by its load id, not by its contents.
+    """
+    response_columns_ordered = response_columns_for_question(df, selected_question)
+    return create_combined_ac_pdf(_select_acs(df, ac_key), selected_question, demographics, response_columns_ordered)
+
+
+@st.cache_data(ttl=600, show_spinner=False, hash_funcs={pd.DataFrame: _survey_frame_token})
+def selection_options(df):
+    """Question list, demographic map and AC options for the selectors, limited to columns df has.
+
+    df must be df_survey_original: it is keyed by its load id, not by its contents.
+    """
+    survey_question_columns = [col for col in SURVEY_QUESTION_COLUMNS if col in df.columns]
+    # Filter out demographic columns not present in the DataFrame
+    demographic_cols_for_tables = {
+        display: actual for display, actual in DEMOGRAPHIC_COLS_FOR_TABLES.items()
+        if actual in df.columns
+    }
+    ac_options = ["All"] + df["AC Name"].cat.categories.tolist() if "AC Name" in df.columns else ["All"]
+    return survey_question_columns, demographic_cols_for_tables, ac_options
 
 # --- Dashboard UI ---
 st.title("Survey Data Analysis")
@@ -111,27 +448,7 @@ if df_survey_original.empty:
     st.warning("Could not load survey data. Please check the Google Sheet URL and ensure it's published correctly.")
 else:
     # --- Define Columns for Selections ---
-    survey_question_columns = [
-        "Do you know who the KPCC President is?",
-        "Can you name the person?",
-        "Who is your favorite candidate for Chief Minister?",
-        "Who do you think will win in your constituency?",
-        "Who do you think will win the overall State Assembly Elections?",
-        "Whom will you vote for?"
-    ]
-    survey_question_columns = [col for col in survey_question_columns if col in df_survey_original.columns]
-
-    demographic_cols_for_tables = {
-        "What is your gender?": "What is your gender?",
-        "What is your age?": "What is your age?",
-        "What is your religion?": "What is your religion?",
-        "What is your community?": "What is your community?"
-    }
-    # Filter out demographic columns not present in the DataFrame
-    demographic_cols_for_tables = {
-        display: actual for display, actual in demographic_cols_for_tables.items()
-        if actual in df_survey_original.columns
-    }
+    survey_question_columns, demographic_cols_for_tables, ac_options = selection_options(df_survey_original)
 
     # --- Main Selectors ---
     col_q, col_ac = st.columns(2)
@@ -144,7 +461,6 @@ else:
             key="survey_question_selector"
         )
 
-    ac_options = ["All"] + sorted(df_survey_original["AC Name"].unique().tolist()) if "AC Name" in df_survey_original.columns else ["All"]
     with col_ac:
         selected_acs = st.multiselect(
             "Select Assembly Constituency (select 'All' for overall, or multiple individual ACs)",
@@ -156,7 +472,8 @@ else:
     st.markdown("---")
 
     # --- Filtering Data based on AC ---
-    current_df = df_survey_original.copy()
+    # The selection is passed to the cached table/PDF builders as a sorted tuple; () means all ACs
+    ac_key = ()
     ac_header_display = "All Constituencies"
 
     if selected_acs:
@@ -169,12 +486,12 @@ else:
             ac_header_display = "All Constituencies"
             # No AC filtering needed if "All" is the only selection
         elif selected_acs: # Specific ACs are selected
-            current_df = current_df[current_df["AC Name"].isin(selected_acs)]
+            ac_key = tuple(sorted(selected_acs))
             ac_header_display = ", ".join(selected_acs)
     else: # No ACs selected (multiselect is empty)
         st.warning("No Assembly Constituency selected. Showing data for ALL constituencies by default.")
         ac_header_display = "All Constituencies (Default - None Selected)"
-        # current_df remains df_survey_original.copy()
+        # ac_key stays () so all ACs are used
 
     # --- Display Header ---
     if selected_question:
@@ -185,119 +502,37 @@ else:
         st.info("Please select a survey question.")
         st.stop()
 
-    # --- Determine Response Columns for the selected question ---
-    # For the specific KPCC question, we prioritize "No" and "Yes" as per the image
-    if selected_question == "Do you know who the KPCC President is?":
-        response_columns_ordered = ['No', 'Yes']
-        # Add 'Not Answered' if it exists in the data for this question after filtering
-        unique_responses_in_data = current_df[selected_question].fillna("Not Answered").astype(str).unique()
-        if "Not Answered" in unique_responses_in_data and "Not Answered" not in response_columns_ordered:
-             response_columns_ordered.append("Not Answered")
-    else:
-        # For other questions, take all unique responses, sort them for consistency
-        # (or you could take top N, etc.)
-        response_columns_ordered = sorted(current_df[selected_question].fillna("Not Answered").astype(str).unique().tolist())
-
-
-    # --- Pre-calculate Grand Total row data (based on current_df and selected_question) ---
-    grand_total_row_data = {}
-    if not current_df.empty:
-        grand_total_base_count = len(current_df) # Total respondents in filtered ACs
-        grand_total_row_data["Total Number"] = grand_total_base_count
-        
-        # Counts and percentages for the specific `response_columns_ordered`
-        question_responses_series = current_df[selected_question].fillna("Not Answered").astype(str)
-        counts_for_grand_total = question_responses_series.value_counts()
-
-        for resp in response_columns_ordered:
-            count = counts_for_grand_total.get(resp, 0)
-            percentage = (count / grand_total_base_count * 100) if grand_total_base_count > 0 else 0
-            grand_total_row_data[f"{resp} %"] = f"{percentage:.2f}%"
-    else: # If current_df is empty after filtering
-        grand_total_row_data["Total Number"] = 0
-        for resp in response_columns_ordered:
-            grand_total_row_data[f"{resp} %"] = "0.00%"
-
-
     # --- Generate and Display Cross-Tabulation Tables ---
-    for demo_display_name, demo_actual_col in demographic_cols_for_tables.items():
-        if demo_actual_col not in current_df.columns:
-            st.warning(f"Demographic column '{demo_display_name}' not found in the data for the selected ACs.")
-            continue
-
-        st.subheader(f"{demo_display_name}")
-
-        # Handle NaN values for crosstab creation
-        df_for_crosstab = current_df.copy()
-        df_for_crosstab[selected_question] = df_for_crosstab[selected_question].fillna("Not Answered").astype(str)
-        df_for_crosstab[demo_actual_col] = df_for_crosstab[demo_actual_col].fillna("Not Specified").astype(str)
-
-        if df_for_crosstab.empty:
-            st.write("No data for this demographic group with current filters.")
-            continue
-
-        try:
-            # Create the cross-tabulation for counts
-            crosstab_df = pd.crosstab(df_for_crosstab[demo_actual_col], df_for_crosstab[selected_question])
-
-            # Ensure all expected response_columns_ordered are present, add if missing
-            for resp in response_columns_ordered:
-                if resp not in crosstab_df.columns:
-                    crosstab_df[resp] = 0
-            
-            # Reorder columns to ensure consistency (e.g., 'No' then 'Yes')
-            crosstab_df = crosstab_df[response_columns_ordered]
-
-            # Calculate "Total Number" for each category in the demographic column
-            crosstab_df["Total Number"] = crosstab_df[response_columns_ordered].sum(axis=1)
-            
-            # Calculate percentages for each response within each demographic category
-            percentage_cols_display_order = []
-            for resp_col in response_columns_ordered:
-                perc_col_name = f"{resp_col} %"
-                percentage_cols_display_order.append(perc_col_name)
-                crosstab_df[perc_col_name] = (crosstab_df[resp_col] / crosstab_df["Total Number"].replace(0, pd.NA) * 100)
-            
-            # Prepare the final display DataFrame
-            crosstab_df = crosstab_df.reset_index()
-            crosstab_df.rename(columns={demo_actual_col: demo_display_name}, inplace=True)
-            
-            display_cols_final_order = [demo_display_name, "Total Number"] + percentage_cols_display_order
-            
-            table_df_final = crosstab_df[display_cols_final_order].copy() # Use .copy() to avoid SettingWithCopyWarning
-
-            # Add the pre-calculated Grand Total row
-            grand_total_row_to_append = grand_total_row_data.copy()
-            grand_total_row_to_append[demo_display_name] = "Grand Total" # Set the first column name
-            
-            # Ensure all columns exist in grand_total_row_to_append, fill with NA if not
-            for col in table_df_final.columns:
-                if col not in grand_total_row_to_append:
-                    grand_total_row_to_append[col] = pd.NA 
-            
-            grand_total_df_for_table = pd.DataFrame([grand_total_row_to_append])[table_df_final.columns] # Ensure order and columns match
-            
-            table_df_final = pd.concat([table_df_final, grand_total_df_for_table], ignore_index=True)
-
-            # Format percentages for display
-            for p_col in percentage_cols_display_order:
-                if p_col in table_df_final.columns:
-                     table_df_final[p_col] = table_df_final[p_col].apply(lambda x: f"{x:.2f}%" if pd.notnull(x) and isinstance(x, (int, float)) else x)
-            
-            st.dataframe(table_df_final, use_container_width=True, hide_index=True)
-
-        except Exception as e:
-            st.error(f"Could not generate table for {demo_display_name}: {e}")
-        st.markdown("---") # Separator between tables
+    # Tables are cached per (AC selection, question), so reruns that change neither are cache hits
+    try:
+        tables = compute_tables(df_survey_original, ac_key, selected_question, demographic_cols_for_tables)
+    except Exception as e:
+        st.error(f"Could not generate tables: {e}")
+        tables = {}
+
+    if tables:
+        # One tab per demographic; tracking the selected tab means only its table is rendered and sent
+        demographic_tabs = st.tabs(list(tables), key="demographic_tabs", on_change="rerun")
+        for tab, (demo_display_name, table_df_final) in zip(demographic_tabs, tables.items()):
+            if tab.open is False:
+                continue
+            with tab:
+                if table_df_final.empty:
+                    st.write("No data for this demographic group with current filters.")
+                else:
+                    st.dataframe(table_df_final, width="stretch", hide_index=True)
+        st.markdown("---")
 
     # --- Download Combined PDF Button ---
-    if st.button("Download Combined AC PDF"):
-        with st.spinner("Generating PDF..."):
-            pdf_bytes = create_combined_ac_pdf(current_df, selected_question, demographic_cols_for_tables)
-        st.download_button(
-            label="Click to Download",
-            data=pdf_bytes,
-            file_name="ac_tables.pdf",
-            mime="application/pdf",
-        )
+    # Passing a callable defers building the PDF until the button is actually clicked,
+    # so reruns from other widgets never pay for it
+    st.download_button(
+        label="Download Combined AC PDF",
+        data=functools.partial(
+            combined_ac_pdf_bytes, df_survey_original, ac_key, selected_question, demographic_cols_for_tables
+        ),
+        file_name="ac_tables.pdf",
+        mime="application/pdf",
+        on_click="ignore",
+    )
 